@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import pandas as pd
+import csv
+
+from tabulate import tabulate
 
 # params
 file_formats = ['json', 'csv']
 
-# read the csv file into a dataframe
-df = pd.read_csv('supported-indices.csv')
+# read the csv file into a list of rows
+with open('supported-indices.csv', newline='', encoding='utf-8') as f:
+    rows = list(csv.DictReader(f))
 
 # generate string of download links
 def gen_download_links(code, file_formats):
@@ -18,7 +21,8 @@ def gen_download_links(code, file_formats):
 
     return str_download[:-3]
 
-# for each row in the dataframe generate string of download links
-df['Download'] = df.apply(lambda row: gen_download_links(row['Code'], file_formats), axis=1)
+# for each row generate string of download links
+for row in rows:
+    row['Download'] = gen_download_links(row['Code'], file_formats)
 
-print(df.to_markdown(index=False))
+print(tabulate(rows, headers='keys', tablefmt='pipe'))
@@ -1,63 +1,108 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
-import pandas as pd
-import requests
-
-from selectorlib import Extractor
-
-def convert_symbol_wglh(symbol):
-    return symbol + 'SS' if symbol[0] == '6' else symbol + 'SZ'
+import contextlib
+import csv
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import orjson
+
+from lxml import etree, html
+from lxml.cssselect import CSSSelector
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+
+HEADERS = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
+
+# shared session so requests to the same host reuse pooled connections;
+# responses are cached on disk and the last good copy is served if a fetch fails
+SESSION = CachedSession(
+    '.cache/http_cache.sqlite',
+    expire_after=21600,
+    urls_expire_after={'www.bloomberg.com': 3600},
+    cache_control=True,
+    stale_if_error=True,
+)
+SESSION.headers.update(HEADERS)
+# no adapter-level retries: run_job is the only retry layer and backs off
+# outside the per-host slot that fetch() holds
+adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+SESSION.mount('https://', adapter)
+SESSION.mount('http://', adapter)
+
+# limit concurrent requests per host to avoid being rate-limited
+HOST_SEMAPHORES = {
+    'wglh.com': threading.BoundedSemaphore(2),
+    'www.slickcharts.com': threading.BoundedSemaphore(2),
+    'www.bloomberg.com': threading.BoundedSemaphore(4),
+}
+
+def fetch(url):
+    with HOST_SEMAPHORES.get(urlparse(url).hostname, contextlib.nullcontext()):
+        r = SESSION.get(url, timeout=30)
+
+    # stale_if_error served an expired copy because the fresh fetch failed
+    if r.from_cache and r.is_expired:
+        print(f'Warning: fetching {url} failed, using a stale cached copy.')
+
+    # surface 429/5xx responses as errors so run_job retries them
+    r.raise_for_status()
+    return r
+
+# selectors are compiled once and shared by every fetch
+WGLH_SYMBOL = CSSSelector('td small.text-secondary')
+WGLH_NAME = CSSSelector('tr td:nth-of-type(2) a')
+
+SLICKCHARTS_SYMBOL = CSSSelector('tr td:nth-of-type(3) a')
+SLICKCHARTS_NAME = CSSSelector('div.col-lg-7 tr td:nth-of-type(2) a')
+
+BLOOMBERG_SYMBOL = CSSSelector('div.security-summary a.security-summary__ticker')
+BLOOMBERG_NAME = CSSSelector('div.security-summary a.security-summary__name')
+
+def get_text(element):
+    return ' '.join(t.strip() for t in element.itertext() if t.strip())
+
+def extract(url, r, symbol_selector, name_selector):
+    try:
+        doc = html.fromstring(r.text)
+        symbols = [get_text(e) for e in symbol_selector(doc)]
+        names = [get_text(e) for e in name_selector(doc)]
+    except etree.ParserError:
+        # an empty body cannot be parsed; treat it as a page without constituents
+        symbols, names = [], []
+
+    if not symbols or len(symbols) != len(names):
+        # evict the bad page so retries and reruns fetch it again; after a
+        # redirect it is cached under both the requested and the final URL
+        SESSION.cache.delete(urls=[url, r.url])
+        if not symbols:
+            raise ValueError(f'No constituents found at {r.url}')
+        raise ValueError(f'Found {len(symbols)} symbols but {len(names)} names at {r.url}')
+
+    return [{'Symbol': symbol, 'Name': name} for symbol, name in zip(symbols, names)]
 
 def get_constituents_from_wglh(url):
-    selector_yml = '''
-                    Symbol:
-                        css: 'td small.text-secondary'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                    Name:
-                        css: 'tr td:nth-of-type(2) a'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                   '''
-
-    e = Extractor.from_yaml_string(selector_yml)
-
-    headers = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
-    r = requests.get(url, headers=headers)
-
-    data = e.extract(r.text)
-    df = pd.DataFrame(data)
+    r = fetch(url)
+    records = extract(url, r, WGLH_SYMBOL, WGLH_NAME)
 
-    df['Symbol'] = df['Symbol'].apply(convert_symbol_wglh)
+    # Shanghai symbols start with '6', the rest are listed in Shenzhen
+    for record in records:
+        record['Symbol'] += 'SS' if record['Symbol'][0] == '6' else 'SZ'
 
-    return df
+    return records
 
 def get_constituents_from_slickcharts(url):
-    selector_yml = '''
-                    Symbol:
-                        css: 'tr td:nth-of-type(3) a'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                    Name:
-                        css: 'div.col-lg-7 tr td:nth-of-type(2) a'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                   '''
+    r = fetch(url)
+    return extract(url, r, SLICKCHARTS_SYMBOL, SLICKCHARTS_NAME)
 
-    e = Extractor.from_yaml_string(selector_yml)
-
-    headers = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
-    r = requests.get(url, headers=headers)
-
-    data = e.extract(r.text)
-    df = pd.DataFrame(data)
-
-    return df
+def get_constituents_from_bloomberg(url):
+    r = fetch(url)
+    return extract(url, r, BLOOMBERG_SYMBOL, BLOOMBERG_NAME)
 
 # 沪深300
 def get_constituents_csi300():
@@ -101,188 +146,91 @@ def get_constituents_dowjones():
 
 # DAX
 def get_constituents_dax():
-    # convert symbol from 'SYMBOL:GR' to 'SYMBOL.DE'
-    def convert_symbol_dax(symbol):
-        return symbol[:-3] + '.DE'
-
-    selector_yml = '''
-                    Symbol:
-                        css: 'div.security-summary a.security-summary__ticker'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                    Name:
-                        css: 'div.security-summary a.security-summary__name'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                   '''
-
-    e = Extractor.from_yaml_string(selector_yml)
-
     url = 'https://www.bloomberg.com/quote/DAX:IND/members'
-    headers = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
-    r = requests.get(url, headers=headers)
+    records = get_constituents_from_bloomberg(url)
 
-    data = e.extract(r.text)
-    df = pd.DataFrame(data)
-
-    df['Symbol'] = df['Symbol'].apply(convert_symbol_dax)
+    # convert symbol from 'SYMBOL:GR' to 'SYMBOL.DE'
+    for record in records:
+        record['Symbol'] = record['Symbol'][:-3] + '.DE'
 
-    return df
+    return records
 
 # Hang Seng Index
 def get_constituents_hsi():
-    # convert symbol from 'XX:HK' to '00XX.HK'
-    def convert_symbol_hsi(symbol):
-        return symbol.rjust(7, '0').replace(':', '.')
-
-    selector_yml = '''
-                    Symbol:
-                        css: 'div.security-summary a.security-summary__ticker'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                    Name:
-                        css: 'div.security-summary a.security-summary__name'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                   '''
-
-    e = Extractor.from_yaml_string(selector_yml)
-
     url = 'https://www.bloomberg.com/quote/HSI:IND/members'
-    headers = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
-    r = requests.get(url, headers=headers)
-
-    data = e.extract(r.text)
-    df = pd.DataFrame(data)
+    records = get_constituents_from_bloomberg(url)
 
-    df['Symbol'] = df['Symbol'].apply(convert_symbol_hsi)
+    # convert symbol from 'XX:HK' to '00XX.HK'
+    for record in records:
+        record['Symbol'] = record['Symbol'].rjust(7, '0').replace(':', '.')
 
-    return df
+    return records
 
 # FTSE 100 (UKX)
 def get_constituents_ftse100():
-    # convert symbol from 'SYMBOL:LN' to 'SYMBOL.L'
-    def convert_symbol_ftse100(symbol):
-        return symbol.replace(':LN', '.L')
-
-    selector_yml = '''
-                    Symbol:
-                        css: 'div.security-summary a.security-summary__ticker'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                    Name:
-                        css: 'div.security-summary a.security-summary__name'
-                        xpath: null
-                        multiple: true
-                        type: Text
-                   '''
-
-    e = Extractor.from_yaml_string(selector_yml)
-
     url = 'https://www.bloomberg.com/quote/UKX:IND/members'
-    headers = { 'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36' }
-    r = requests.get(url, headers=headers)
-
-    data = e.extract(r.text)
-    df = pd.DataFrame(data)
+    records = get_constituents_from_bloomberg(url)
 
-    df['Symbol'] = df['Symbol'].apply(convert_symbol_ftse100)
-
-    return df
+    # convert symbol from 'SYMBOL:LN' to 'SYMBOL.L'
+    for record in records:
+        record['Symbol'] = record['Symbol'].replace(':LN', '.L')
+
+    return records
+
+N_RETRIES = 5
+RETRY_BASE = 1.0
+RETRY_CAP = 30.0
+
+# (label, fetcher, code)
+JOBS = [
+    ('CSI 300', get_constituents_csi300, 'csi300'),
+    ('CSI 500', get_constituents_csi500, 'csi500'),
+    ('CSI 1000', get_constituents_csi1000, 'csi1000'),
+    ('SSE', get_constituents_sse, 'sse'),
+    ('SZSE', get_constituents_szse, 'szse'),
+    ('NASDAQ 100', get_constituents_nasdaq100, 'nasdaq100'),
+    ('S&P 500', get_constituents_sp500, 'sp500'),
+    ('Dow Jones', get_constituents_dowjones, 'dowjones'),
+    ('DAX', get_constituents_dax, 'dax'),
+    ('Hang Seng Index', get_constituents_hsi, 'hsi'),
+    ('FTSE 100', get_constituents_ftse100, 'ftse100'),
+]
+
+def write_out(records, code):
+    with open(f'docs/constituents-{code}.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['Symbol', 'Name'], lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+
+    Path(f'docs/constituents-{code}.json').write_bytes(orjson.dumps(records))
+
+def run_job(label, fetcher, code):
+    print(f'Fetching the constituents of {label}...')
+    delay = RETRY_BASE
+    for i in range(N_RETRIES):
+        try:
+            records = fetcher()
+            break
+        except Exception:
+            if i == N_RETRIES - 1:
+                raise
+            # decorrelated jitter; each wait is capped at RETRY_CAP, so a job sleeps
+            # at most (N_RETRIES - 1) * RETRY_CAP seconds in total (plus request timeouts)
+            delay = min(RETRY_CAP, random.uniform(RETRY_BASE, delay * 3))
+            time.sleep(delay)
+
+    write_out(records, code)
 
 # main
 if __name__ == '__main__':
-    print('Fetching the constituents of CSI 300...')
-    try:
-        df = get_constituents_csi300()
-        df.to_csv('docs/constituents-csi300.csv', index=False)
-        df.to_json('docs/constituents-csi300.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of CSI 300.')
-
-    print('Fetching the constituents of CSI 500...')
-    try:
-        df = get_constituents_csi500()
-        df.to_csv('docs/constituents-csi500.csv', index=False)
-        df.to_json('docs/constituents-csi500.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of CSI 500.')
-
-    print('Fetching the constituents of CSI 1000...')
-    try:
-        df = get_constituents_csi1000()
-        df.to_csv('docs/constituents-csi1000.csv', index=False)
-        df.to_json('docs/constituents-csi1000.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of CSI 1000.')
-
-    print('Fetching the constituents of SSE...')
-    try:
-        df = get_constituents_sse()
-        df.to_csv('docs/constituents-sse.csv', index=False)
-        df.to_json('docs/constituents-sse.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of SSE.')
-
-    print('Fetching the constituents of SZSE...')
-    try:
-        df = get_constituents_szse()
-        df.to_csv('docs/constituents-szse.csv', index=False)
-        df.to_json('docs/constituents-szse.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of SZSE.')
-
-    print('Fetching the constituents of NASDAQ 100...')
-    try:
-        df = get_constituents_nasdaq100()
-        df.to_csv('docs/constituents-nasdaq100.csv', index=False)
-        df.to_json('docs/constituents-nasdaq100.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of NASDAQ 100.')
-
-    print('Fetching the constituents of S&P 500...')
-    try:
-        df = get_constituents_sp500()
-        df.to_csv('docs/constituents-sp500.csv', index=False)
-        df.to_json('docs/constituents-sp500.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of S&P 500.')
-
-    print('Fetching the constituents of Dow Jones...')
-    try:
-        df = get_constituents_dowjones()
-        df.to_csv('docs/constituents-dowjones.csv', index=False)
-        df.to_json('docs/constituents-dowjones.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of Dow Jones.')
-
-    print('Fetching the constituents of DAX...')
-    try:
-        df = get_constituents_dax()
-        df.to_csv('docs/constituents-dax.csv', index=False)
-        df.to_json('docs/constituents-dax.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of DAX.')
-
-    print('Fetching the constituents of Hang Seng Index...')
-    try:
-        df = get_constituents_hsi()
-        df.to_csv('docs/constituents-hsi.csv', index=False)
-        df.to_json('docs/constituents-hsi.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of Hang Seng Index.')
-
-    print('Fetching the constituents of FTSE 100...')
-    try:
-        df = get_constituents_ftse100()
-        df.to_csv('docs/constituents-ftse100.csv', index=False)
-        df.to_json('docs/constituents-ftse100.json', orient='records')
-    except:
-        print('Failed to fetch the constituents of FTSE 100.')
+    # fetch all indices concurrently; total time is bounded by the slowest host
+    with ThreadPoolExecutor(max_workers=len(JOBS)) as executor:
+        futures = [(label, executor.submit(run_job, label, fetcher, code)) for label, fetcher, code in JOBS]
+
+        for label, future in futures:
+            try:
+                future.result()
+            except Exception:
+                print(f'Failed to fetch the constituents of {label}.')
 
     print('Done.')
@@ -0,0 +1,98 @@
+import contextlib
+import importlib.util
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / 'get-constituents.py'
+
+BAD_PAGE = b'<html><body>Please verify you are a human</body></html>'
+GOOD_PAGE = b'''<html><body>
+<div class="security-summary">
+  <a class="security-summary__ticker">SAP:GR</a>
+  <a class="security-summary__name">SAP SE</a>
+</div>
+</body></html>'''
+
+@pytest.fixture
+def gc(tmp_path, monkeypatch):
+    # the module creates its cache relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'docs').mkdir()
+
+    spec = importlib.util.spec_from_file_location('get_constituents', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module.time, 'sleep', lambda seconds: None)
+    return module
+
+@contextlib.contextmanager
+def serve(respond):
+    # respond(n) returns (status, body) for the n-th request, counting from 1
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # '/redirect' permanently moves to '/members' and is not counted
+            if self.path == '/redirect':
+                self.send_response(301)
+                self.send_header('Location', '/members')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            hits.append(self.path)
+            status, body = respond(len(hits))
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{httpd.server_port}', hits
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+def test_retry_after_bad_page_refetches(gc):
+    with serve(lambda n: (200, BAD_PAGE if n <= 2 else GOOD_PAGE)) as (base, hits):
+        gc.run_job('Test', lambda: gc.get_constituents_from_bloomberg(f'{base}/members'), 'test')
+
+    assert len(hits) == 3
+    assert Path('docs/constituents-test.csv').read_text() == 'Symbol,Name\nSAP:GR,SAP SE\n'
+
+def test_retry_after_bad_page_refetches_through_redirect(gc):
+    with serve(lambda n: (200, BAD_PAGE if n <= 2 else GOOD_PAGE)) as (base, hits):
+        gc.run_job('Test', lambda: gc.get_constituents_from_bloomberg(f'{base}/redirect'), 'test')
+
+    assert len(hits) == 3
+    assert Path('docs/constituents-test.csv').read_text() == 'Symbol,Name\nSAP:GR,SAP SE\n'
+
+def test_retry_after_empty_page_refetches(gc):
+    with serve(lambda n: (200, b'  \n' if n <= 2 else GOOD_PAGE)) as (base, hits):
+        gc.run_job('Test', lambda: gc.get_constituents_from_bloomberg(f'{base}/members'), 'test')
+
+    assert len(hits) == 3
+    assert Path('docs/constituents-test.csv').read_text() == 'Symbol,Name\nSAP:GR,SAP SE\n'
+
+def test_stale_cached_copy_is_reported(gc, capsys):
+    with serve(lambda n: (200, GOOD_PAGE) if n == 1 else (503, b'down for maintenance')) as (base, hits):
+        url = f'{base}/members'
+        # cache the good page, then expire it so the next fetch goes to the server
+        gc.fetch(url)
+        gc.SESSION.settings.expire_after = 0
+        gc.SESSION.cache.reset_expiration(0)
+
+        r = gc.fetch(url)
+
+    assert len(hits) == 2
+    assert r.from_cache and r.content == GOOD_PAGE
+    assert 'stale cached copy' in capsys.readouterr().out